@@ -1,5 +1,16 @@
+import os
 import sys
 import random
+from functools import lru_cache
+from itertools import compress
+from math import gcd, isqrt, log, prod
+from bisect import bisect_left, bisect_right
+
+try:
+    # Optional: GMP-backed primality test (BPSW), much faster than pure Python
+    from gmpy2 import is_prime as gmpy2_is_prime
+except ImportError:
+    gmpy2_is_prime = None
 
 """
 B-Tree implementation with order statistics and range queries.
@@ -17,24 +28,24 @@ class BTreeNode:
     - keys: sorted list of keys stored in this node
     - children: list of child pointers (empty for leaf nodes)
     - subtree_size: total number of keys in the subtree rooted at this node
-    - parent: pointer to parent node (None for root)
     """
 
-    def __init__(self, min_degree, is_leaf=False, parent=None):
+    # Fixed attribute layout: no per-node __dict__, faster attribute access
+    __slots__ = ("keys", "children", "is_leaf", "min_degree", "subtree_size")
+
+    def __init__(self, min_degree, is_leaf=False):
         """
         Initialize a new B-Tree node.
         
         Args:
             min_degree (int): Minimum degree of the B-Tree (t)
             is_leaf (bool): True if this is a leaf node
-            parent (BTreeNode): Parent node reference (None for root)
         """
         self.keys = []                   # Sorted list of keys stored in this node
         self.children = []               # List of child node references  
         self.is_leaf = is_leaf           # True if leaf, False if internal node
         self.min_degree = min_degree     # Minimum degree (t)
         self.subtree_size = 0            # Total number of keys in subtree rooted here
-        self.parent = parent             # Pointer to parent node (None for root)
 
     # ────────────────────── Size Management for Order Statistics ──────────────────────
     
@@ -45,26 +56,11 @@ class BTreeNode:
         For leaf nodes: size = number of keys in this node
         For internal nodes: size = number of keys in this node + sum of all children's sizes
         """
-        if self.is_leaf:
-            self.subtree_size = len(self.keys)
-        else:
-            # Sum up all keys in this node plus all keys in child subtrees
-            self.subtree_size = len(self.keys) + sum(child.subtree_size for child in self.children)
-
-    def update_ancestor_sizes(self, size_delta):
-        """
-        Propagate a size change up the tree to all ancestors.
-        
-        Args:
-            size_delta (int): Change in size (+1 for insert, -1 for delete)
-            
-        This enables efficient order statistics by maintaining accurate
-        subtree sizes without full recomputation.
-        """
-        current_node = self
-        while current_node:
-            current_node.subtree_size += size_delta
-            current_node = current_node.parent
+        # Plain accumulator loop - avoids a generator frame per call
+        total = len(self.keys)
+        for child in self.children:
+            total += child.subtree_size
+        self.subtree_size = total
 
     # ───────────────────────── Node Splitting for Insertion ─────────────────────────
     
@@ -79,43 +75,38 @@ class BTreeNode:
         This operation:
         1. Creates a new node containing the upper half of full_child's keys
         2. Promotes the middle key from full_child to this node
-        3. Updates parent pointers and subtree sizes
+        3. Updates subtree sizes
         
         Used when inserting into a full child - we split it first to make room.
         """
         min_degree = self.min_degree
         
         # Create new node to hold upper half of the split child
-        new_right_child = BTreeNode(min_degree, full_child.is_leaf, parent=self)
+        new_right_child = BTreeNode(min_degree, full_child.is_leaf)
 
         # Split keys: middle key gets promoted, upper half goes to new node
         middle_key_index = min_degree - 1
         promoted_key = full_child.keys[middle_key_index]
         
         # Move upper half of keys to new node
+        # (truncate the left half in place instead of copying it)
         new_right_child.keys = full_child.keys[min_degree:]
-        full_child.keys = full_child.keys[:middle_key_index]
+        del full_child.keys[middle_key_index:]
 
         # If not a leaf, also split the children
         if not full_child.is_leaf:
             new_right_child.children = full_child.children[min_degree:]
-            full_child.children = full_child.children[:min_degree]
-            
-            # Update parent pointers for moved children
-            for child in new_right_child.children:
-                child.parent = new_right_child
+            del full_child.children[min_degree:]
 
-        # Recompute sizes for the split nodes
-        full_child.recompute_subtree_size()
+        # Size the new node once; the left half loses it plus the promoted key
         new_right_child.recompute_subtree_size()
+        full_child.subtree_size -= new_right_child.subtree_size + 1
 
         # Insert the new child and promoted key into this node
+        # (this node's size is unchanged - keys were only reorganized)
         self.children.insert(child_index + 1, new_right_child)
         self.keys.insert(child_index, promoted_key)
 
-        # Update this node's size (total keys in tree unchanged, just reorganized)
-        self.recompute_subtree_size()
-
     def insert_non_full(self, key):
         """
         Insert a key into this node, assuming the node is not full.
@@ -123,29 +114,45 @@ class BTreeNode:
         Args:
             key (int): The key to insert
             
+        Returns:
+            int: Size change of this subtree (1 if inserted, 0 if already present)
+            
         Recursively finds the correct position and inserts the key.
-        Splits any full children encountered during the descent.
+        Splits any full children encountered during the descent, and
+        applies the returned size change to each node as the recursion unwinds.
         """
+        keys = self.keys
+        key_index = bisect_left(keys, key)
+        
+        # Duplicate found on the way down - nothing to insert
+        if key_index < len(keys) and keys[key_index] == key:
+            return 0
+            
         if self.is_leaf:
             # Simple insertion into sorted key list
-            insort(self.keys, key)
-            # Update size of this node and all ancestors
-            self.update_ancestor_sizes(+1)
-        else:
-            # Find which child should contain this key
-            child_index = bisect_left(self.keys, key)
-            target_child = self.children[child_index]
+            keys.insert(key_index, key)
+            self.subtree_size += 1
+            return 1
+            
+        max_keys = 2 * self.min_degree - 1
+        
+        # Child at key_index should contain this key
+        target_child = self.children[key_index]
 
-            # If child is full, split it first
-            if len(target_child.keys) == 2 * self.min_degree - 1:
-                self.split_child(child_index, target_child)
+        # If child is full, split it first
+        if len(target_child.keys) == max_keys:
+            self.split_child(key_index, target_child)
+            
+            # After split, determine which of the two children gets the key
+            if key == keys[key_index]:
+                return 0  # Key was the promoted median
+            if key > keys[key_index]:
+                key_index += 1
                 
-                # After split, determine which of the two children gets the key
-                if key > self.keys[child_index]:
-                    child_index += 1
-                    
-            # Recursively insert into the appropriate child
-            self.children[child_index].insert_non_full(key)
+        # Recursively insert into the appropriate child
+        size_delta = self.children[key_index].insert_non_full(key)
+        self.subtree_size += size_delta
+        return size_delta
 
     # ──────────────────────── Node Merging and Borrowing for Deletion ──────────────────────────
     
@@ -176,17 +183,14 @@ class BTreeNode:
         # If not leaves, also merge children
         if not left_child.is_leaf:
             left_child.children.extend(right_child.children)
-            # Update parent pointers for moved children
-            for child in right_child.children:
-                child.parent = left_child
 
         # Remove separator key and right child from this node
         self.keys.pop(left_child_index)
         self.children.pop(left_child_index + 1)
 
-        # Update sizes
-        left_child.recompute_subtree_size()
-        self.recompute_subtree_size()
+        # Left child absorbs the separator and the right subtree
+        # (this node's size is unchanged - the separator only moved down)
+        left_child.subtree_size += right_child.subtree_size + 1
 
     def borrow_from_left_sibling(self, child_index):
         """
@@ -206,14 +210,15 @@ class BTreeNode:
         self.keys[child_index - 1] = left_sibling.keys.pop()
 
         # If not leaves, also move a child pointer
+        moved_size = 1
         if not target_child.is_leaf:
             moved_child = left_sibling.children.pop()
             target_child.children.insert(0, moved_child)
-            moved_child.parent = target_child
+            moved_size += moved_child.subtree_size
 
         # Update sizes (total unchanged, just redistributed)
-        left_sibling.recompute_subtree_size()
-        target_child.recompute_subtree_size()
+        left_sibling.subtree_size -= moved_size
+        target_child.subtree_size += moved_size
 
     def borrow_from_right_sibling(self, child_index):
         """
@@ -233,14 +238,15 @@ class BTreeNode:
         self.keys[child_index] = right_sibling.keys.pop(0)
 
         # If not leaves, also move a child pointer
+        moved_size = 1
         if not target_child.is_leaf:
             moved_child = right_sibling.children.pop(0)
             target_child.children.append(moved_child)
-            moved_child.parent = target_child
+            moved_size += moved_child.subtree_size
 
         # Update sizes (total unchanged, just redistributed)
-        right_sibling.recompute_subtree_size()
-        target_child.recompute_subtree_size()
+        right_sibling.subtree_size -= moved_size
+        target_child.subtree_size += moved_size
 
     def ensure_child_has_enough_keys(self, child_index):
         """
@@ -309,6 +315,8 @@ class BTree:
             min_degree (int): Minimum degree (t), must be >= 2
                             - Nodes can have 2t - 1 keys maximum
                             - Non-root nodes must have t - 1 keys minimum
+                            - Larger t (e.g. 32) means fewer levels per operation;
+                              t < 8 is mainly useful for illustration
         """
         if min_degree < 2:
             raise ValueError("Minimum degree must be >= 2")
@@ -328,19 +336,22 @@ class BTree:
         Returns:
             bool: True if key exists, False otherwise
         """
-        # Binary search within this node's keys
-        key_index = bisect_left(node.keys, key)
-        
-        # Check if we found an exact match
-        if key_index < len(node.keys) and node.keys[key_index] == key:
-            return True
+        while True:
+            keys = node.keys
             
-        # If leaf node and no match, key doesn't exist
-        if node.is_leaf:
-            return False
+            # Binary search within this node's keys
+            key_index = bisect_left(keys, key)
             
-        # Recursively search appropriate child subtree
-        return self._search_in_subtree(node.children[key_index], key)
+            # Check if we found an exact match
+            if key_index < len(keys) and keys[key_index] == key:
+                return True
+                
+            # If leaf node and no match, key doesn't exist
+            if node.is_leaf:
+                return False
+                
+            # Descend into the appropriate child subtree
+            node = node.children[key_index]
 
     def search(self, key):
         """
@@ -363,29 +374,96 @@ class BTree:
         Args:
             key (int): Key to insert (must be positive integer)
             
-        Ignores duplicate keys. Maintains B-Tree properties by splitting
-        full nodes as needed during insertion.
+        Ignores duplicate keys (detected during the descent itself).
+        Maintains B-Tree properties by splitting full nodes as needed
+        during insertion.
         """
         if key <= 0:
             raise ValueError("Keys must be positive integers")
             
-        # Don't insert duplicates
-        if self.search(key):
-            return
-            
         root = self.root
         
         # If root is full, create new root and split old root
         if len(root.keys) == 2 * self.min_degree - 1:
             new_root = BTreeNode(self.min_degree, is_leaf=False)
             new_root.children.append(root)
-            root.parent = new_root
+            new_root.subtree_size = root.subtree_size  # Same keys, one level up
             new_root.split_child(0, root)
             self.root = new_root
             
         # Insert into the (possibly new) root
         self.root.insert_non_full(key)
 
+    # ──────────────────────────── Bulk Loading ──────────────────────────────
+    
+    @classmethod
+    def bulk_load(cls, min_degree, sorted_keys):
+        """
+        Build a B-Tree directly from sorted, distinct keys.
+        
+        Args:
+            min_degree (int): Minimum degree (t), must be >= 2
+            sorted_keys (List[int]): Strictly increasing positive integers
+            
+        Returns:
+            BTree: A tree containing exactly sorted_keys
+            
+        Packs the tree bottom-up in O(n): the keys are dealt out to leaves as
+        evenly as possible (each with at most 2t - 1 keys), one key between
+        neighbouring leaves is lifted as their separator, and the separators
+        are packed the same way into the next level until one root remains.
+        No splits or rebalancing are ever needed.
+        """
+        tree = cls(min_degree)
+        if not sorted_keys:
+            return tree
+            
+        if sorted_keys[0] <= 0:
+            raise ValueError("Keys must be positive integers")
+        if any(a >= b for a, b in zip(sorted_keys, sorted_keys[1:])):
+            raise ValueError("Keys must be sorted and distinct")
+            
+        # Each node takes up to 2t - 1 keys plus the separator that follows it
+        max_slots_per_node = 2 * min_degree
+        level_keys = list(sorted_keys)
+        level_children = None  # None while building the leaf level
+        
+        while True:
+            slots = len(level_keys) + 1
+            node_count = -(-slots // max_slots_per_node)
+            base_slots, extra_slots = divmod(slots, node_count)
+            
+            nodes = []
+            separators = []
+            key_pos = 0
+            child_pos = 0
+            
+            for node_index in range(node_count):
+                # Spread keys evenly so every node has between t - 1 and 2t - 1
+                num_keys = base_slots - 1 + (node_index < extra_slots)
+                
+                node = BTreeNode(min_degree, is_leaf=level_children is None)
+                node.keys = level_keys[key_pos:key_pos + num_keys]
+                key_pos += num_keys
+                
+                if level_children is not None:
+                    node.children = level_children[child_pos:child_pos + num_keys + 1]
+                    child_pos += num_keys + 1
+                    
+                node.recompute_subtree_size()
+                nodes.append(node)
+                
+                # Lift the next key up as the separator to the following node
+                if node_index < node_count - 1:
+                    separators.append(level_keys[key_pos])
+                    key_pos += 1
+                    
+            if node_count == 1:
+                tree.root = nodes[0]
+                return tree
+                
+            level_keys, level_children = separators, nodes
+
     # ───────────────────────────── Deletion ────────────────────────────────
     
     def _find_minimum_key(self, node):
@@ -404,12 +482,15 @@ class BTree:
             node = node.children[-1]
         return node.keys[-1]
 
-    def _remove_from_leaf(self, node, key_index):
+    def _remove_from_leaf(self, path, key_index):
         """
-        Remove key at key_index from leaf node.
+        Remove key at key_index from the leaf at the end of path.
+        
+        Every node on path (root down to the leaf) loses one key from its subtree.
         """
-        node.keys.pop(key_index)
-        node.update_ancestor_sizes(-1)
+        path[-1].keys.pop(key_index)
+        for node in path:
+            node.subtree_size -= 1
 
     def _remove_from_internal_node(self, node, key_index):
         """
@@ -418,7 +499,10 @@ class BTree:
         Uses one of three strategies:
         1. Replace with predecessor if left child has enough keys
         2. Replace with successor if right child has enough keys  
-        3. Merge children and recurse if both children have minimum keys
+        3. Merge children if both children have minimum keys
+        
+        Returns:
+            tuple: (child node, key) the deletion must continue with
         """
         key_to_remove = node.keys[key_index]
         left_child = node.children[key_index]
@@ -428,53 +512,55 @@ class BTree:
         if len(left_child.keys) >= self.min_degree:
             predecessor = self._find_maximum_key(left_child)
             node.keys[key_index] = predecessor
-            self._delete_from_subtree(left_child, predecessor)
+            return left_child, predecessor
             
         # Replace with successor
-        elif len(right_child.keys) >= self.min_degree:
+        if len(right_child.keys) >= self.min_degree:
             successor = self._find_minimum_key(right_child)
             node.keys[key_index] = successor
-            self._delete_from_subtree(right_child, successor)
+            return right_child, successor
             
-        # Merge and recurse
-        else:
-            node.merge_children(key_index)
-            self._delete_from_subtree(node.children[key_index], key_to_remove)
+        # Merge, then delete the key from the merged child
+        node.merge_children(key_index)
+        return node.children[key_index], key_to_remove
 
     def _delete_from_subtree(self, node, key):
         """
         Delete key from subtree rooted at node.
         
         Handles all cases of B-Tree deletion while maintaining invariants.
+        Descends iteratively, fixing up each child before stepping into it,
+        and records the path so subtree sizes can be updated on removal.
         """
-        key_index = bisect_left(node.keys, key)
+        min_degree = self.min_degree
+        path = []
         
-        # Key is in this node
-        if key_index < len(node.keys) and node.keys[key_index] == key:
-            if node.is_leaf:
-                self._remove_from_leaf(node, key_index)
-            else:
-                self._remove_from_internal_node(node, key_index)
+        while True:
+            path.append(node)
+            keys = node.keys
+            key_index = bisect_left(keys, key)
+            
+            # Key is in this node
+            if key_index < len(keys) and keys[key_index] == key:
+                if node.is_leaf:
+                    self._remove_from_leaf(path, key_index)
+                    return
+                node, key = self._remove_from_internal_node(node, key_index)
+                continue
                 
-        # Key is in subtree
-        else:
+            # Key is in subtree
             if node.is_leaf:
                 return  # Key not found
                 
             # Ensure target child has enough keys before descending
-            if len(node.children[key_index].keys) < self.min_degree:
+            if len(node.children[key_index].keys) < min_degree:
                 node.ensure_child_has_enough_keys(key_index)
                 
-                # After merge/borrow, target child might have moved
-                if key_index >= len(node.keys) + 1:
-                    # Merged with left sibling - key is now in left child
-                    self._delete_from_subtree(node.children[key_index - 1], key)
-                else:
-                    # Merged with right sibling or borrowed - position unchanged
-                    self._delete_from_subtree(node.children[key_index], key)
-            else:
-                # Child has enough keys - safe to descend directly
-                self._delete_from_subtree(node.children[key_index], key)
+                # Merged with left sibling - key is now in left child
+                if key_index >= len(keys) + 1:
+                    key_index -= 1
+                    
+            node = node.children[key_index]
 
     def delete(self, key):
         """
@@ -483,19 +569,14 @@ class BTree:
         Args:
             key (int): Key to delete
             
-        Ignores requests to delete non-existent keys.
-        Maintains B-Tree properties during deletion.
+        Ignores requests to delete non-existent keys (the descent simply
+        finds nothing to remove). Maintains B-Tree properties during deletion.
         """
-        # Key not found, nothing to delete
-        if not self.search(key):
-            return
-            
         self._delete_from_subtree(self.root, key)
         
         # If root becomes empty after deletion, make its only child the new root
         if not self.root.is_leaf and len(self.root.keys) == 0:
             self.root = self.root.children[0]
-            self.root.parent = None
 
     # ────────────────────────── Order Statistics ──────────────────────────────
     
@@ -510,31 +591,38 @@ class BTree:
         Returns:
             int: The k-th smallest key, or -1 if k is out of bounds
         """
-        key_index = 0
-        
-        while key_index < len(node.keys):
-            # Count keys in left subtree
-            left_subtree_size = 0 if node.is_leaf else node.children[key_index].subtree_size
+        while True:
+            keys = node.keys
+            num_keys = len(keys)
             
-            # If k-th element is in left subtree
-            if k <= left_subtree_size:
-                return self._select_kth_smallest(node.children[key_index], k)
+            # Leaf: the k-th element is simply the k-th key here
+            if node.is_leaf:
+                return keys[k - 1] if k <= num_keys else -1
                 
-            # Account for left subtree
-            k -= left_subtree_size
+            children = node.children
+            key_index = 0
             
-            # If k-th element is this key
-            if k == 1:
-                return node.keys[key_index]
+            while key_index < num_keys:
+                # Count keys in left subtree
+                left_subtree_size = children[key_index].subtree_size
                 
-            # Account for this key  
-            k -= 1
-            key_index += 1
-
-        # k-th element must be in rightmost subtree
-        if node.is_leaf:
-            return -1
-        return self._select_kth_smallest(node.children[-1], k)
+                # If k-th element is in left subtree
+                if k <= left_subtree_size:
+                    break
+                    
+                # Account for left subtree
+                k -= left_subtree_size
+                
+                # If k-th element is this key
+                if k == 1:
+                    return keys[key_index]
+                    
+                # Account for this key  
+                k -= 1
+                key_index += 1
+                
+            # k-th element is in the child left of key_index (rightmost if none)
+            node = children[key_index]
 
     def select(self, k):
         """
@@ -561,33 +649,30 @@ class BTree:
         Returns:
             int: 1-based rank of key, or -1 if key not found
         """
-        key_index = 0
         rank_so_far = 0
-
-        while key_index < len(node.keys):
-            left_subtree_size = 0 if node.is_leaf else node.children[key_index].subtree_size
-
-            # Key is smaller than current key - must be in left subtree (if it exists)
-            if key < node.keys[key_index]:
-                if node.is_leaf:
-                    return -1  # Key not found
-                subtree_rank = self._find_rank(node.children[key_index], key)
-                return -1 if subtree_rank == -1 else rank_so_far + subtree_rank
-
-            # Found exact match
-            if key == node.keys[key_index]:
-                return rank_so_far + left_subtree_size + 1
-
-            # Key is larger - skip this key and its left subtree
-            rank_so_far += left_subtree_size + 1
-            key_index += 1
-
-        # Key must be in rightmost subtree (if it exists)
-        if node.is_leaf:
-            return -1  # Key not found
+        
+        while True:
+            keys = node.keys
+            
+            # Binary search for the key's position within this node
+            key_index = bisect_left(keys, key)
+            found = key_index < len(keys) and keys[key_index] == key
             
-        subtree_rank = self._find_rank(node.children[-1], key)
-        return -1 if subtree_rank == -1 else rank_so_far + subtree_rank
+            if node.is_leaf:
+                return rank_so_far + key_index + 1 if found else -1
+                
+            # Skip the keys before key_index together with their left subtrees
+            children = node.children
+            rank_so_far += key_index
+            for child_index in range(key_index):
+                rank_so_far += children[child_index].subtree_size
+                
+            # Found exact match - everything in its left subtree ranks below it
+            if found:
+                return rank_so_far + children[key_index].subtree_size + 1
+                
+            # Key must be in the child left of key_index
+            node = children[key_index]
 
     def rank(self, key):
         """
@@ -601,9 +686,36 @@ class BTree:
         """
         return self._find_rank(self.root, key)
 
+    def _count_keys_less_than(self, key):
+        """
+        Count the keys in the tree that are strictly smaller than key.
+        
+        Args:
+            key (int): Upper bound (exclusive); need not be in the tree
+            
+        Returns:
+            int: Number of keys < key, found with a single root-to-leaf descent
+        """
+        count = 0
+        node = self.root
+        
+        while True:
+            keys = node.keys
+            key_index = bisect_left(keys, key)
+            count += key_index
+            
+            if node.is_leaf:
+                return count
+                
+            # Every subtree left of key_index lies entirely below key
+            children = node.children
+            for child_index in range(key_index):
+                count += children[child_index].subtree_size
+            node = children[key_index]
+
     # ───────────────────────────── Range Queries ──────────────────────────────
     
-    def _collect_keys_in_range(self, node, min_key, max_key, result_list):
+    def _collect_keys_in_range(self, node, min_key, max_key, result_list, key_filter=None):
         """
         Collect all keys in range [min_key, max_key] from subtree rooted at node.
         
@@ -612,26 +724,68 @@ class BTree:
             min_key (int): Minimum key to include (inclusive)
             max_key (int): Maximum key to include (inclusive)
             result_list (List[int]): List to append found keys to
+            key_filter (callable): Optional predicate; only keys passing it are collected
             
         Uses efficient tree traversal - only visits subtrees that might contain keys in range.
+        Only the subtrees on the two range boundaries are searched; any child lying
+        between two in-range keys is entirely in range and is collected whole.
         """
-        # Find first key >= min_key
-        start_index = bisect_left(node.keys, min_key)
+        keys = node.keys
+        
+        # Keys in range occupy keys[start_index:end_index]
+        start_index = bisect_left(keys, min_key)
+        end_index = bisect_right(keys, max_key, start_index)
 
-        # Check left subtree of first relevant key
-        if not node.is_leaf:
-            self._collect_keys_in_range(node.children[start_index], min_key, max_key, result_list)
+        # Leaf: copy the whole slice at once
+        if node.is_leaf:
+            keys_in_node = keys[start_index:end_index]
+            if key_filter is not None:
+                keys_in_node = filter(key_filter, keys_in_node)
+            result_list.extend(keys_in_node)
+            return
+
+        children = node.children
+        
+        # Left boundary: subtree before the first in-range key
+        self._collect_keys_in_range(children[start_index], min_key, max_key, result_list, key_filter)
+        if start_index == end_index:
+            return
 
-        # Collect all keys in range from this node
-        key_index = start_index
-        while key_index < len(node.keys) and node.keys[key_index] <= max_key:
-            result_list.append(node.keys[key_index])
+        # Interior: keys in range, each followed by a subtree that lies fully in range
+        for key_index in range(start_index, end_index - 1):
+            key = keys[key_index]
+            if key_filter is None or key_filter(key):
+                result_list.append(key)
+            self._collect_subtree(children[key_index + 1], result_list, key_filter)
             
-            # Also check right subtree of this key
-            if not node.is_leaf:
-                self._collect_keys_in_range(node.children[key_index + 1], min_key, max_key, result_list)
-                
-            key_index += 1
+        # Right boundary: last in-range key and the subtree after it
+        key = keys[end_index - 1]
+        if key_filter is None or key_filter(key):
+            result_list.append(key)
+        self._collect_keys_in_range(children[end_index], min_key, max_key, result_list, key_filter)
+
+    def _collect_subtree(self, node, result_list, key_filter=None):
+        """
+        Collect every key of the subtree rooted at node, in sorted order.
+        
+        Args:
+            node (BTreeNode): Root of a subtree known to lie entirely in range
+            result_list (List[int]): List to append keys to
+            key_filter (callable): Optional predicate; only keys passing it are collected
+        """
+        if node.is_leaf:
+            keys_in_node = node.keys
+            if key_filter is not None:
+                keys_in_node = filter(key_filter, keys_in_node)
+            result_list.extend(keys_in_node)
+            return
+            
+        children = node.children
+        self._collect_subtree(children[0], result_list, key_filter)
+        for key, child in zip(node.keys, children[1:]):
+            if key_filter is None or key_filter(key):
+                result_list.append(key)
+            self._collect_subtree(child, result_list, key_filter)
 
     def keys_in_range(self, min_key, max_key):
         """
@@ -662,67 +816,160 @@ class BTree:
         Returns:
             List[int]: Sorted list of prime numbers in range, or [-1] if none found
         """
-        keys_in_range = self.keys_in_range(min_key, max_key)
-        if keys_in_range == [-1]:
-            return [-1]
+        if min_key > max_key:
+            min_key, max_key = max_key, min_key
+            
+        prime_numbers = []
+        
+        # Two descents tell how densely the range is populated with keys
+        key_count = self._count_keys_less_than(max_key + 1) - self._count_keys_less_than(min_key)
+        
+        if key_count > 0 and sieve_is_cheaper(min_key, max_key, key_count):
+            # Dense range: sieve it once and look every key up
+            keys = []
+            self._collect_keys_in_range(self.root, min_key, max_key, keys)
+            key_pos = bisect_left(keys, 2)
+            for segment_start, prime_flags in segmented_prime_sieve(min_key, max_key):
+                segment_end = bisect_left(keys, segment_start + len(prime_flags), key_pos)
+                prime_numbers.extend([key for key in keys[key_pos:segment_end]
+                                      if prime_flags[key - segment_start]])
+                key_pos = segment_end
+        elif key_count > 0:
+            # Sparse or short range: test primality during the traversal - no intermediate list of keys
+            self._collect_keys_in_range(self.root, min_key, max_key, prime_numbers, is_prime)
             
-        prime_numbers = [key for key in keys_in_range if is_prime(key)]
         return prime_numbers if prime_numbers else [-1]
     
 # ───────────────────────────── Helper Functions ──────────────────────────────
 
-def bisect_left(sorted_list, target_value):
+@lru_cache(maxsize=None)
+def primes_up_to(limit):
     """
-    Return the leftmost index at which target_value should be inserted in sorted_list.
-    
-    Uses binary search to find the insertion point that maintains sorted order.
-    If target_value already exists in the list, returns the index of the first occurrence.
+    Sieve of Eratosthenes, memoised so every caller shares one prime table.
     
     Args:
-        sorted_list (List[int]): Sorted list to search in
-        target_value (int): Value to find insertion point for
+        limit (int): Largest number to consider
         
     Returns:
-        int: Index where target_value should be inserted (0 to len(sorted_list))
+        Tuple[int, ...]: All primes <= limit, in increasing order
     """
-    left_bound, right_bound = 0, len(sorted_list)
+    if limit < 2:
+        return ()
+    flags = bytearray(b"\x01") * (limit + 1)
+    flags[0] = flags[1] = 0
+    for p in range(2, isqrt(limit) + 1):
+        if flags[p]:
+            flags[p * p::p] = bytes(len(range(p * p, limit + 1, p)))
+    return tuple(compress(range(limit + 1), flags))
+
+# (bound, witnesses): Miller-Rabin with these witnesses is exact for every
+# n below bound, so smaller numbers need fewer rounds
+DETERMINISTIC_MR_WITNESS_SETS = (
+    (1373653, (2, 3)),
+    (25326001, (2, 3, 5)),
+    (3215031751, (2, 3, 5, 7)),
+    (2152302898747, (2, 3, 5, 7, 11)),
+    (3474749660383, (2, 3, 5, 7, 11, 13)),
+    (341550071728321, (2, 3, 5, 7, 11, 13, 17)),
+    (3825123056546413051, (2, 3, 5, 7, 11, 13, 17, 19, 23)),
+    (318665857834031151167461, (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37)),
+)
+
+# The first 50 primes (up to 229) for trial division, and their product so that
+# a single gcd checks all of them at once
+SMALL_PRIMES = primes_up_to(229)
+SMALL_PRIMES_SET = frozenset(SMALL_PRIMES)
+SMALL_PRIMES_PRODUCT = prod(SMALL_PRIMES)
+
+# Rough costs in nanoseconds, measured in CPython: flagging one integer of a
+# sieve segment, crossing one base prime out of one segment, and one per-key
+# primality test (averaged over keys of both parities, so including the cheap
+# rejections). Beyond SIEVE_MAX_KEY the base-prime table gets too large.
+SIEVE_COST_PER_INT = 4
+SIEVE_COST_PER_BASE_PRIME = 1000
+MR_COST_PER_KEY = 2000
+SIEVE_MAX_KEY = 10 ** 12
+SIEVE_SEGMENT_SIZE = 1 << 18  # 256 KiB of flags per segment stays cache-resident
+
+def sieve_is_cheaper(low, high, key_count):
+    """
+    Decide whether sieving [low, high] beats testing its keys one by one.
+    
+    Besides the span itself, every segment pays one slice assignment per base
+    prime up to sqrt(high) (about 78k near 10^12), however short the range.
     
-    while left_bound < right_bound:
-        middle_index = (left_bound + right_bound) // 2
+    Args:
+        low (int): Start of the range (inclusive)
+        high (int): End of the range (inclusive)
+        key_count (int): Number of keys stored in the range
         
-        if sorted_list[middle_index] < target_value:
-            left_bound = middle_index + 1        
-        else:                                         
-            right_bound = middle_index                   
-            
-    return left_bound
-
-def insort(sorted_list, new_value):
+    Returns:
+        bool: True if the segmented sieve is estimated to be faster
     """
-    Insert new_value into sorted_list in place, maintaining sorted order.
+    if high > SIEVE_MAX_KEY:
+        return False
+    span = high - max(low, 2) + 1
+    if span <= 0:
+        return True  # Nothing to sieve
+    
+    # Prime number theorem estimate of how many base primes get crossed out
+    root = max(isqrt(high), 3)
+    base_prime_count = root / log(root)
+    segment_count = -(-span // SIEVE_SEGMENT_SIZE)
     
-    Finds the correct insertion position using binary search, then inserts
-    the value at that position. The list is modified in-place.
+    sieve_cost = (span * SIEVE_COST_PER_INT +
+                  segment_count * base_prime_count * SIEVE_COST_PER_BASE_PRIME)
+    return sieve_cost < key_count * MR_COST_PER_KEY
+
+def segmented_prime_sieve(low, high):
+    """
+    Segmented sieve of Eratosthenes over [low, high].
     
     Args:
-        sorted_list (List[int]): Sorted list to insert into (modified in-place)
-        new_value (int): Value to insert
+        low (int): Start of the range (inclusive)
+        high (int): End of the range (inclusive)
+        
+    Yields:
+        (int, bytearray): A segment's first number and its flags, where
+                          flags[i] is 1 exactly when segment start + i is prime
     """
-    insertion_index = bisect_left(sorted_list, new_value)
-    sorted_list.insert(insertion_index, new_value)
+    low = max(low, 2)
+    
+    # Round the base-prime limit up to a power of two so that queries of
+    # similar magnitude reuse the same cached table
+    base_primes = primes_up_to(1 << isqrt(high).bit_length())
+    
+    for segment_start in range(low, high + 1, SIEVE_SEGMENT_SIZE):
+        segment_size = min(SIEVE_SEGMENT_SIZE, high - segment_start + 1)
+        segment_last = segment_start + segment_size - 1
+        flags = bytearray(b"\x01") * segment_size
+        
+        # Cross out multiples of each base prime, starting no lower than p^2
+        for p in base_primes:
+            if p * p > segment_last:
+                break
+            first_multiple = max(p * p, -(-segment_start // p) * p) - segment_start
+            flags[first_multiple::p] = bytes(len(range(first_multiple, segment_size, p)))
+            
+        yield segment_start, flags
 
 def is_prime(n, k = 40):
     """
-    Miller-Rabin primality test (probabilistic).
+    Miller-Rabin primality test.
     
-    Tests whether n is likely prime using k random witnesses.
+    Deterministic for n < 318665857834031151167461 (which covers all 64-bit
+    integers) using the smallest known-exact set of prime witnesses for n's
+    magnitude (2 to 12 rounds); larger n fall back to k random witnesses.
+    Numbers with a prime factor up to 229 are screened out by a single gcd
+    first. Uses gmpy2's native test instead when gmpy2 is installed.
     
     Args:
         n: Integer to test
-        k: Number of witness rounds (default 40 gives error probability ≤ 1/4^40, which is practically negligible)
+        k: Number of random witness rounds for n beyond the deterministic bound
+           (default 40 gives error probability ≤ 1/4^40, which is practically negligible)
     
     Returns:
-        True if n is probably prime, False if definitely composite
+        True if n is prime (probably prime for very large n), False if composite
     """
     # Handle small cases
     if n == 2 or n == 3:
@@ -730,6 +977,19 @@ def is_prime(n, k = 40):
     if n < 2 or n % 2 == 0:
         return False
     
+    # Fast path: GMP implementation of the test
+    if gmpy2_is_prime is not None:
+        return bool(gmpy2_is_prime(n))
+    
+    # Trial division by all small primes at once: a shared factor means
+    # n is composite, unless n is that small prime itself
+    if gcd(n, SMALL_PRIMES_PRODUCT) != 1:
+        return n in SMALL_PRIMES_SET
+    
+    # No prime factor up to 229 and n < 229^2, so n must be prime
+    if n < SMALL_PRIMES[-1] ** 2:
+        return True
+    
     # Express n-1 as 2^s × t where t is odd
     s = 0
     t = n - 1
@@ -737,22 +997,28 @@ def is_prime(n, k = 40):
         s += 1
         t //= 2
     
-    # Test k random witnesses
-    for _ in range(k):
-        # Pick random witness a ∈ [2, n-2]
-        a = random.randint(2, n - 2)
-        
+    # Fixed witnesses are exact below their bound, random ones beyond the last
+    for bound, witnesses in DETERMINISTIC_MR_WITNESS_SETS:
+        if n < bound:
+            break
+    else:
+        witnesses = (random.randint(2, n - 2) for _ in range(k))
+    
+    # Small n were settled above, so every witness here is below n
+    n_minus_1 = n - 1
+    for a in witnesses:
         # Compute a^t mod n
         x = pow(a, t, n)
         
         # Check if a^t ≡ 1 or -1 (mod n)
-        if x == 1 or x == n - 1:
+        if x == 1 or x == n_minus_1:
             continue  # This witness passes
         
         # Square x repeatedly (s-1 times), looking for -1
+        # (plain multiply-and-reduce is cheaper than pow() for a single squaring)
         for _ in range(s - 1):
-            x = pow(x, 2, n)
-            if x == n - 1:
+            x = x * x % n
+            if x == n_minus_1:
                 break
         else:
             # If we never found -1, n is composite
@@ -767,17 +1033,27 @@ def read_integers_from_file(file_path):
     """
     Read integers from a text file, one per line.
     
+    The whole file is read and split in one go instead of line by line;
+    blank lines and surrounding whitespace are ignored.
+    
     Args:
         file_path (str): Path to file containing integers
         
-    Yields:
-        int: Each integer found in the file
+    Returns:
+        Iterator[int]: Each integer found in the file
     """
     with open(file_path) as file:
-        for line in file:
-            line = line.strip()
-            if line:  # Skip empty lines
-                yield int(line)
+        return map(int, file.read().split())
+
+def format_key_list(keys):
+    """
+    Format a list of keys as one space-separated output line (as bytes).
+    
+    The [-1] returned by range queries with no matches formats as b"-1".
+    The line is rendered by a single %-format call into one buffer rather
+    than building and joining a bytes object per key.
+    """
+    return (b"%d " * len(keys) % tuple(keys))[:-1]
 
 def main():
     """
@@ -802,76 +1078,74 @@ def main():
     # Extract file paths
     insert_file, delete_file, commands_file = args[1:]
 
-    # Build B-Tree with specified minimum degree
-    btree = BTree(min_degree)
-
-    # Insert all valid keys from insert file
+    # Collect all valid keys from insert file (duplicates collapse in the set)
+    keys_to_insert = set()
     for key in read_integers_from_file(insert_file):
         if key <= 0:
             print(f"Skipped invalid key (non-positive): {key}")
             continue
-        btree.insert(key)
+        keys_to_insert.add(key)
+        
+    # Build B-Tree with specified minimum degree in one bottom-up pass
+    btree = BTree.bulk_load(min_degree, sorted(keys_to_insert))
             
     # Delete all keys from delete file
     for key in read_integers_from_file(delete_file):
         btree.delete(key)
 
-    # Process commands and collect results
-    results = []
-    
-    # Read commands file line by line
+    # The tree no longer changes once commands run, so the last few range
+    # answers can be reused when the same query repeats
+    @lru_cache(maxsize=8)
+    def keys_in_range_line(min_key, max_key):
+        return format_key_list(btree.keys_in_range(min_key, max_key))
+
+    @lru_cache(maxsize=8)
+    def primes_in_range_line(min_key, max_key):
+        return format_key_list(btree.primes_in_range(min_key, max_key))
+
+    # Command name -> handler producing that command's output line
+    command_handlers = {
+        b"select": lambda parts: b"%d" % btree.select(int(parts[1])),
+        b"rank": lambda parts: b"%d" % btree.rank(int(parts[1])),
+        b"keysInRange": lambda parts: keys_in_range_line(int(parts[1]), int(parts[2])),
+        b"primesInRange": lambda parts: primes_in_range_line(int(parts[1]), int(parts[2])),
+    }
+
+    # Read the whole commands file at once; commands stay as raw bytes
+    # (int() parses ASCII bytes directly, so lines are never decoded)
     try:
-        with open(commands_file) as cmd_file:
-            for line in cmd_file:
-                line = line.strip()
-                if not line: # Skip empty lines
-                    continue
+        with open(commands_file, "rb") as cmd_file:
+            command_lines = cmd_file.read().splitlines()
+    except Exception as e:
+        sys.exit(f"Error reading commands file: {e}")
 
-                # Split into command and arguments
+    # Process commands, streaming each result (already encoded as bytes)
+    # through a 1 MiB write buffer instead of holding all output in memory;
+    # lines end with the platform's line separator as text mode would
+    line_separator = os.linesep.encode()
+    try:
+        with open("output.txt", "wb", buffering=1 << 20) as out_file:
+            for line in command_lines:
+                # Split into command and arguments; bytes.split() already
+                # drops surrounding whitespace, so no separate strip() pass
                 command_parts = line.split()
+                if not command_parts: # Skip empty lines
+                    continue
                 
-                try:
-                    # Extract command name
-                    command = command_parts[0]
+                # Unknown commands produce no output
+                handler = command_handlers.get(command_parts[0])
+                if handler is None:
+                    continue
                     
-                    if command == "select":
-                        k = int(command_parts[1])
-                        result = btree.select(k)
-                        results.append(str(result))
-                        
-                    elif command == "rank":
-                        key = int(command_parts[1])
-                        result = btree.rank(key)
-                        results.append(str(result))
-                        
-                    elif command == "keysInRange":
-                        min_key, max_key = map(int, command_parts[1:3])
-                        result = btree.keys_in_range(min_key, max_key)
-                        if result == [-1]:
-                            results.append("-1")
-                        else:
-                            results.append(" ".join(map(str, result)))
-                            
-                    elif command == "primesInRange":
-                        min_key, max_key = map(int, command_parts[1:3])
-                        result = btree.primes_in_range(min_key, max_key)
-                        if result == [-1]:
-                            results.append("-1")
-                        else:
-                            results.append(" ".join(map(str, result)))
-                            
+                try:
+                    result = handler(command_parts)
                 except Exception:
                     # Handle malformed commands gracefully
-                    results.append("-1")
+                    result = b"-1"
+                    
+                out_file.write(result)
+                out_file.write(line_separator)
                 
-    except Exception as e:
-        sys.exit(f"Error reading commands file: {e}")
-
-    # Write results to output file
-    try:
-        with open("output.txt", "w") as out_file:
-            for line in results:
-                out_file.write(f"{line}\n")
     except Exception as e:
         sys.exit(f"Error writing output file: {e}")
 